@@ -5,104 +5,152 @@ Naveen Dharmathunga (dasheenaveen@outlook.com)
 This work is licensed under the MIT License.
 See LICENSE.txt file in the root directory for more information.
 """
+import functools
 import glob
+import itertools
 import os
 import json
+import mmap
+import operator
+import pickle
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+
+# orjson is optional: it parses the large icons.json much faster than the standard json module.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # download zip file from https://fontawesome.com/download and extract into fontawesome directory.
 SOURCE_DIR = 'fontawesome'
 OUTPUT_DIR = 'output\\fontawesome'
 OUTPUT_FILE = '6.sty'
+# Write buffer for the generated style file (256 KiB), well above the default block size
+WRITE_BUFFER_SIZE = 256 * 1024
+# Parsed icons.json is cached in a build-owned folder and reused while the json file is unchanged.
+# It is kept out of SOURCE_DIR, which holds the contents of a downloaded archive: only files this
+# script wrote itself are ever unpickled.
+CACHE_DIR = '.cache'
+METADATA_CACHE_FILE = 'icons.json.cache'
+# Font commands defined in header.sty for the regular and the brands fonts
+FA_FONT = r'\FA'
+FA_BRANDS_FONT = r'\FABrands'
+# Number of threads used to copy fonts, licenses and other files into the output folder
+COPY_WORKERS = 4
+
+
+# Parse an icons.json file
+def parse_icons_metadata(input_file: str) -> dict:
+    if orjson is not None:
+        # orjson reads straight from the memory-mapped file, skipping the copy into a bytes object
+        with open(input_file, 'rb') as metadata_file, \
+                mmap.mmap(metadata_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                memoryview(mapped) as view:
+            return orjson.loads(view)
+
+    # icons.json is UTF-8; decode it explicitly so the result matches the orjson path everywhere
+    with open(input_file, encoding='utf-8') as metadata_file:
+        metadata = json.load(metadata_file)
+        return metadata
 
 
-# Read the icons.json file in the metadata folder
+# Read the icons.json file in the metadata folder, using the on-disk cache when it is up to date
+@functools.lru_cache(maxsize=1)
 def get_icons_metadata() -> dict:
     input_file = os.path.join(SOURCE_DIR, "metadata", "icons.json")
-    with open(input_file) as metadata_file:
-        metadata = json.load(metadata_file)
-        return metadata
+    cache_file = os.path.join(CACHE_DIR, METADATA_CACHE_FILE)
+    input_stat = os.stat(input_file)
+    cache_key = (input_stat.st_mtime_ns, input_stat.st_size)
+
+    # The cache holds two pickles: the key of the icons.json it was built from, then the metadata
+    try:
+        with open(cache_file, 'rb') as cache:
+            if pickle.load(cache) == cache_key:
+                return pickle.load(cache)
+    except Exception:
+        # a missing or unreadable cache (unpickling can fail in many ways) is simply rebuilt
+        pass
+
+    metadata = parse_icons_metadata(input_file)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_file, 'wb') as cache:
+            pickle.dump(cache_key, cache, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(metadata, cache, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Failed to write metadata cache: {cache_file}, Stacktrace: {e}")
+    return metadata
 
 
 # Read the header latex style file
+@functools.lru_cache(maxsize=1)
 def get_tex_header() -> str:
     input_file = 'header.sty'
     with open(input_file) as header:
         return header.read()
 
 
-def create_icons(metadata: dict) -> str:
-    result = ''
+# Yield the icon definitions one line at a time so they can be streamed to the output file
+def create_icons(metadata: dict) -> Iterator[str]:
     # Example: \faDefineIcon{apple}{\FABrands\symbol{"F179}} % U+F179: Apple
-    output_template = \
-        r'\faDefineIcon{{{name}}}{{{font}{{\symbol{{"{symbol}}}}}}} % U+{symbol}: {label}{term}'
-    for icon_name in sorted(metadata.keys()):
-        font = r"\FA" if "brands" not in metadata[icon_name]["styles"] else r"\FABrands"
-        unicode = metadata[icon_name]["unicode"].upper()
-        label = metadata[icon_name].get("label", "")
-        try:
-            term = ' [' + metadata[icon_name]["search"]["terms"][0] + ']'
-        except IndexError:
-            term = ''
-
-        # write the output line and push it to the result
-        output_line = output_template.format(
-            name=icon_name,
-            font=font,
-            symbol=unicode.zfill(4),
-            label=label,
-            term=term
-        )
-        result += output_line + '\n'
-    return result
+    # sort on the icon name only, so entries are never compared
+    for icon_name, entry in sorted(metadata.items(), key=operator.itemgetter(0)):
+        styles = entry["styles"]
+        font = FA_BRANDS_FONT if "brands" in styles else FA_FONT
+        symbol = entry["unicode"].upper().zfill(4)
+        label = entry.get("label", "")
+        terms = entry.get("search", {}).get("terms", ())
+        term = ' [' + terms[0] + ']' if terms else ''
+
+        definition = rf'\faDefineIcon{{{icon_name}}}{{{font}{{\symbol{{"{symbol}}}}}}}' \
+            rf' % U+{symbol}: {label}{term}'
+        yield definition + '\n'
 
 
 def build_style():
     output_file = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
 
-    with open(output_file, 'w') as style:
-        # write the header
-        style.write(get_tex_header())
-        style.write('\n')
+    with open(output_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as style:
+        # write the header, the streamed icon definitions and the ending line in one pass
+        style.writelines(itertools.chain(
+            (get_tex_header(), '\n'),
+            create_icons(get_icons_metadata()),
+            (r'\endinput',),
+        ))
 
-        # write icon definitions
-        style.write(create_icons(get_icons_metadata()))
 
-        # write the ending line
-        style.write(r'\endinput')
+# Copy a single file into the output directory and return the status message
+def copy_file(file: str, output_dir: str) -> str:
+    filename = os.path.basename(file)
+    try:
+        # copyfile skips the metadata copy of copy2 and uses the OS fast-copy path where available
+        shutil.copyfile(file, os.path.join(output_dir, filename))
+        return f'Copied {filename} to {output_dir}'
+    except PermissionError as e:
+        return f"Failed to copy file: {filename}, Stacktrace: {e}"
 
 
-def copy_other():
-    # Copy fonts
-    files = glob.glob(os.path.join(SOURCE_DIR, 'otfs') + '\\Font Awesome 6 *')
-    output_dir = os.path.join(OUTPUT_DIR, 'fonts')
-    for file in files:
-        filename = os.path.basename(file)
-        try:
-            shutil.copy2(file, output_dir)
-            print(f'Copied {filename} to {output_dir}')
-        except PermissionError as e:
-            print(f"Failed to copy file: {filename}, Stacktrace: {e}")
-
-    # Copy licenses
-    files = glob.glob('licenses\\*')
-    output_dir = os.path.join(OUTPUT_DIR, 'licenses')
-    for file in files:
-        filename = os.path.basename(file)
-        try:
-            shutil.copy2(file, output_dir)
-            print(f'Copied {filename} to {output_dir}')
-        except PermissionError as e:
-            print(f"Failed to copy file: {filename}, Stacktrace: {e}")
+# Copy the fonts, licenses and root files into the output folder and return the status messages
+def copy_other() -> List[str]:
+    # Fonts
+    fonts_dir = os.path.join(OUTPUT_DIR, 'fonts')
+    fonts = glob.glob(os.path.join(SOURCE_DIR, 'otfs') + '\\Font Awesome 6 *')
+    jobs = [(file, fonts_dir) for file in fonts]
 
-    # Copy files in the root directory
-    try:
-        shutil.copy2('README.md', OUTPUT_DIR)
-        print(f'Copied readme to {OUTPUT_DIR}')
-        shutil.copy2('LICENSE.txt', OUTPUT_DIR)
-        print(f'Copied license to {OUTPUT_DIR}')
-    except PermissionError as e:
-        print(f"Failed to copy README.md, Stacktrace: {e}")
+    # Licenses
+    licenses_dir = os.path.join(OUTPUT_DIR, 'licenses')
+    jobs += [(file, licenses_dir) for file in glob.glob('licenses\\*')]
+
+    # Files in the root directory
+    jobs += [('README.md', OUTPUT_DIR), ('LICENSE.txt', OUTPUT_DIR)]
+
+    # The copies are independent of each other, so run them concurrently.
+    # The status messages are returned in job order and left to the caller to print.
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        futures = [executor.submit(copy_file, file, output_dir) for file, output_dir in jobs]
+        return [future.result() for future in futures]
 
 
 # Press the green button in the gutter to run the script.
@@ -117,12 +165,21 @@ if __name__ == '__main__':
 
     print("Cleaned the output directory.")
 
-    # Build the fontawesome6.sty file
-    print("Building fontawesome 6 package...")
-    build_style()
+    # Building the fontawesome6.sty file and copying the other files don't depend on each other,
+    # so copy in the background while the style file is generated
+    # Copy messages are printed after the build, so they don't interleave with its output
+    with ThreadPoolExecutor(max_workers=1) as background:
+        copying = background.submit(copy_other)
+
+        print("Building fontawesome 6 package...")
+        try:
+            build_style()
+        finally:
+            # always collect the copy result, so an error raised by copy_other is never dropped
+            copy_messages = copying.result()
 
-    # Copy other files
     print("Copying files...")
-    copy_other()
+    for message in copy_messages:
+        print(message)
 
     print("Successfully built fontawesome 6 package.")